@@ -1,9 +1,41 @@
+import threading
 import cv2
 import numpy as np
 import onnxruntime as ort
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
-from copy import deepcopy
+
+from ..engines.build_onnx_engine import create_session_options
+from ..utils.lru_cache import LRUCache, get_embedding_key
+
+try:
+    import numba
+except ImportError:  # optional, fall back to NumPy
+    numba = None
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def count_stability_areas(masks, high_threshold, low_threshold):
+        """Count the high/low threshold mask areas of each NxHxW mask in a
+        single pass over the logits."""
+        num_masks = masks.shape[0]
+        flat_masks = masks.reshape(num_masks, -1)
+        intersections = np.zeros(num_masks, dtype=np.int64)
+        unions = np.zeros(num_masks, dtype=np.int64)
+        for b in numba.prange(num_masks):
+            intersection = 0
+            union = 0
+            for value in flat_masks[b]:
+                if value > high_threshold:
+                    intersection += 1
+                if value > low_threshold:
+                    union += 1
+            intersections[b] = intersection
+            unions[b] = union
+        return intersections, unions
 
 
 class EdgeSAMONNX:
@@ -17,19 +49,41 @@ def __init__(
         # TODO: Add back when TensorRT backend is stable
         providers = [p for p in providers if p != "TensorrtExecutionProvider"]
 
+        sess_options = create_session_options()
+
         self.encoder_session = ort.InferenceSession(
-            encoder_model_path, providers=providers
+            encoder_model_path, providers=providers, sess_options=sess_options
         )
         self.decoder_session = ort.InferenceSession(
-            decoder_model_path, providers=providers
+            decoder_model_path, providers=providers, sess_options=sess_options
         )
 
         self.encoder_input_name = self.encoder_session.get_inputs()[0].name
         self.target_length = target_length
 
+        # Bind outputs once, inputs are rebound on every run. The bindings
+        # are shared by the preload thread and request threads, so each run
+        # holds its session's lock from binding to copying out
+        self.encoder_io_binding = self.encoder_session.io_binding()
+        for output in self.encoder_session.get_outputs():
+            self.encoder_io_binding.bind_output(output.name, "cpu")
+        self.encoder_lock = threading.Lock()
+        self.decoder_io_binding = self.decoder_session.io_binding()
+        for output in self.decoder_session.get_outputs():
+            self.decoder_io_binding.bind_output(output.name, "cpu")
+        self.decoder_lock = threading.Lock()
+
+        # Image embeddings keyed by image content, so re-prompting the same
+        # image skips the encoder
+        self.embedding_cache = LRUCache(8)
+
     def run_encoder(self, encoder_inputs):
         """Run encoder"""
-        image_embeddings = self.encoder_session.run(None, encoder_inputs)
+        with self.encoder_lock:
+            for name, value in encoder_inputs.items():
+                self.encoder_io_binding.bind_cpu_input(name, value)
+            self.encoder_session.run_with_iobinding(self.encoder_io_binding)
+            image_embeddings = self.encoder_io_binding.copy_outputs_to_cpu()
         return image_embeddings[0]
 
     @staticmethod
@@ -59,50 +113,98 @@ def transform(self, input_image: np.ndarray) -> np.ndarray:
         # Resize
         h, w, _ = input_image.shape
         target_size = self.get_preprocess_shape(h, w, self.target_length)
-        input_image = cv2.resize(input_image, target_size[::-1])
-
-        # HWC -> CHW
-        input_image = input_image.transpose((2, 0, 1))
+        if target_size != (h, w):
+            input_image = cv2.resize(
+                input_image, target_size[::-1], interpolation=cv2.INTER_LINEAR
+            )
 
-        # CHW -> NCHW
-        input_image = np.ascontiguousarray(input_image)
-        input_image = np.expand_dims(input_image, 0)
+        # HWC -> NCHW, writing each channel plane straight into the buffer
+        h, w = target_size
+        output_image = np.empty((1, 3, h, w), dtype=input_image.dtype)
+        cv2.split(input_image, tuple(output_image[0]))
 
-        return input_image
+        return output_image
 
-    def encode(self, cv_image):
+    def encode_input(self, original_size, input_image):
         """
-        Calculate embedding and metadata for a single image.
+        Calculate embedding and metadata from an already transformed image.
         """
-        original_size = cv_image.shape[:2]
         encoder_inputs = {
-            self.encoder_input_name: self.transform(cv_image),
+            self.encoder_input_name: input_image,
         }
 
         image_embeddings = self.run_encoder(encoder_inputs)
         return {
             "image_embeddings": image_embeddings,
             "original_size": original_size,
+            "input_size": self.get_preprocess_shape(
+                original_size[0], original_size[1], self.target_length
+            ),
         }
 
+    def encode(self, cv_image):
+        """
+        Calculate embedding and metadata for a single image.
+        """
+        key = get_embedding_key(cv_image)
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
+
+        embedding = self.encode_input(
+            cv_image.shape[:2], self.transform(cv_image)
+        )
+        self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def encode_batch(self, cv_images):
+        """
+        Calculate embeddings for several images. The next image is
+        transformed on a worker thread while the encoder runs on the
+        current one.
+        """
+        keys = [get_embedding_key(cv_image) for cv_image in cv_images]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        pending = [i for i, embedding in enumerate(embeddings) if not embedding]
+        if not pending:
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.transform, cv_images[pending[0]])
+            for n, i in enumerate(pending):
+                input_image = future.result()
+                if n + 1 < len(pending):
+                    future = executor.submit(
+                        self.transform, cv_images[pending[n + 1]]
+                    )
+                embeddings[i] = self.encode_input(
+                    cv_images[i].shape[:2], input_image
+                )
+                self.embedding_cache.put(keys[i], embeddings[i])
+        return embeddings
+
     def get_input_points(self, prompt):
         """Get input points"""
-        points = []
-        labels = []
+        num_points = 0
+        for mark in prompt:
+            if mark["type"] == "point":
+                num_points += 1
+            elif mark["type"] == "rectangle":
+                num_points += 2
+        points = np.empty((num_points, 2), dtype=np.float32)
+        labels = np.empty((num_points,), dtype=np.float32)
+        i = 0
         for mark in prompt:
             if mark["type"] == "point":
-                points.append(mark["data"])
-                labels.append(mark["label"])
+                points[i] = mark["data"]
+                labels[i] = mark["label"]
+                i += 1
             elif mark["type"] == "rectangle":
-                points.append([mark["data"][0], mark["data"][1]])  # top left
-                points.append(
-                    [mark["data"][2], mark["data"][3]]
-                )  # bottom right
-                labels.append(2)
-                labels.append(3)
-        points, labels = np.array(points).astype(np.float32), np.array(
-            labels
-        ).astype(np.float32)
+                points[i] = mark["data"][:2]  # top left
+                points[i + 1] = mark["data"][2:4]  # bottom right
+                labels[i] = 2
+                labels[i + 1] = 3
+                i += 2
         return points, labels
 
     @staticmethod
@@ -114,35 +216,48 @@ def calculate_stability_score(
         score is the IoU between the binary masks obtained by thresholding
         the predicted mask logits at high and low values.
         """
-        high_threshold_mask = masks > (mask_threshold + threshold_offset)
-        low_threshold_mask = masks > (mask_threshold - threshold_offset)
+        # The high threshold mask is a subset of the low threshold mask, so
+        # the intersection and union are just the two mask areas.
+        if numba is not None and masks.ndim == 3:
+            intersections, unions = count_stability_areas(
+                np.ascontiguousarray(masks),
+                mask_threshold + threshold_offset,
+                mask_threshold - threshold_offset,
+            )
+            return intersections / np.maximum(unions, 1)
 
         intersections = np.sum(
-            high_threshold_mask & low_threshold_mask,
+            masks > (mask_threshold + threshold_offset),
             axis=(-1, -2),
             dtype=np.int32,
         )
         unions = np.sum(
-            high_threshold_mask | low_threshold_mask,
+            masks > (mask_threshold - threshold_offset),
             axis=(-1, -2),
             dtype=np.int32,
         )
-        return intersections / unions
+        return intersections / np.maximum(unions, 1)
 
     def apply_coords(
-        self, coords: np.ndarray, original_size: Tuple[int, ...]
+        self,
+        coords: np.ndarray,
+        original_size: Tuple[int, ...],
+        input_size: Tuple[int, ...] = None,
     ) -> np.ndarray:
         """
         Expects a numpy array of length 2 in the final dimension. Requires the
-        original image size in (H, W) format.
+        original image size in (H, W) format. The preprocessed input size is
+        recomputed when not given.
         """
         old_h, old_w = original_size
-        new_h, new_w = self.get_preprocess_shape(
-            original_size[0], original_size[1], self.target_length
+        if input_size is None:
+            input_size = self.get_preprocess_shape(
+                original_size[0], original_size[1], self.target_length
+            )
+        new_h, new_w = input_size
+        coords = np.asarray(coords, dtype=np.float32) * np.array(
+            [new_w / old_w, new_h / old_h], dtype=np.float32
         )
-        coords = deepcopy(coords).astype(float)
-        coords[..., 0] = coords[..., 0] * (new_w / old_w)
-        coords[..., 1] = coords[..., 1] * (new_h / old_h)
         return coords
 
     def apply_boxes(self, boxes, original_size, new_size):
@@ -173,36 +288,47 @@ def postprocess_masks(
         """
         img_size = self.target_length
 
-        # Upscale masks to the intermediate size
-        mask = cv2.resize(mask, (img_size, img_size))
-
-        # Remove padding
-        mask = mask[..., : input_size[0], : input_size[1]]
+        # Remove padding directly at the decoder resolution
+        mask_h, mask_w = mask.shape[-2:]
+        crop_h = int(input_size[0] * mask_h / img_size + 0.5)
+        crop_w = int(input_size[1] * mask_w / img_size + 0.5)
+        mask = mask[..., :crop_h, :crop_w]
 
         # Upscale masks to the original size
         new_size = original_size[::-1]
-        mask = cv2.resize(mask, new_size)
+        mask = cv2.resize(mask, new_size, interpolation=cv2.INTER_LINEAR)
 
         return mask
 
-    def run_decoder(self, image_embeddings, original_size, point_coords, point_labels):
+    def run_decoder(
+        self,
+        image_embeddings,
+        original_size,
+        point_coords,
+        point_labels,
+        input_size=None,
+    ):
         """Run decoder"""
 
+        if input_size is None:
+            input_size = self.get_preprocess_shape(
+                *original_size, self.target_length
+            )
+
         if point_coords is None or point_labels is None:
             raise ValueError(
                 "Unable to segment, please input at least one box or point."
             )
 
         if point_coords is not None:
-            if isinstance(point_coords, list):
-                point_coords = np.array(point_coords, dtype=np.float32)
-            if isinstance(point_labels, list):
-                point_labels = np.array(point_labels, dtype=np.float32)
+            # No-ops for the float32 arrays built by get_input_points
+            point_coords = np.asarray(point_coords, dtype=np.float32)
+            point_labels = np.asarray(point_labels, dtype=np.float32)
 
         if point_coords is not None:
             point_coords = self.apply_coords(
-                point_coords, original_size
-            ).astype(np.float32)
+                point_coords, original_size, input_size
+            )
             point_coords = np.expand_dims(point_coords, axis=0)
             point_labels = np.expand_dims(point_labels, axis=0)
 
@@ -214,17 +340,19 @@ def run_decoder(self, image_embeddings, original_size, point_coords, point_label
             "point_coords": point_coords,
             "point_labels": point_labels,
         }
-        scores, masks = self.decoder_session.run(None, input_dict)
+        with self.decoder_lock:
+            for name, value in input_dict.items():
+                self.decoder_io_binding.bind_cpu_input(name, value)
+            self.decoder_session.run_with_iobinding(self.decoder_io_binding)
+            scores, masks = self.decoder_io_binding.copy_outputs_to_cpu()
         mask_threshold = 0.0
         stability_score_offset = 1.0
         scores = self.calculate_stability_score(
             masks[0], mask_threshold, stability_score_offset
         )
-        max_score_index = np.argmax(scores)
+        # Basic indexing with a Python int returns a view of the best mask
+        max_score_index = int(np.argmax(scores))
         masks = masks[0, max_score_index]
-        input_size = self.get_preprocess_shape(
-            *original_size, self.target_length
-        )
         masks = self.postprocess_masks(masks, input_size, original_size)
         masks = masks > 0.0
         return masks
@@ -242,6 +370,7 @@ def predict_masks(self, embedding, prompt, transform_prompt=True):
             embedding["original_size"],
             point_coords,
             point_labels,
+            embedding.get("input_size"),
         )
 
         return masks
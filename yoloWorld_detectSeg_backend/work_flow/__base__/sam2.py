@@ -1,3 +1,5 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List, Tuple, Union
 
 import torch
@@ -10,20 +12,42 @@
 import onnxruntime as ort
 from numpy import ndarray
 
+from ..engines.build_onnx_engine import create_session_options
+from ..utils.lru_cache import LRUCache, get_embedding_key
+
 
 class SegmentAnything2ONNX:
     """Segmentation model using Segment Anything 2 (SAM2)"""
 
     def __init__(self, encoder_model_path, decoder_model_path, device) -> None:
-        self.encoder = SAM2ImageEncoder(encoder_model_path, device)
+        # Run both sessions on one CUDA stream so the encoder features can be
+        # handed to the decoder without a cross-stream sync
+        self.cuda_stream = None
+        if device.lower() == "gpu" and torch.cuda.is_available():
+            self.cuda_stream = torch.cuda.Stream()
+        cuda_stream = (
+            self.cuda_stream.cuda_stream if self.cuda_stream else None
+        )
+        self.encoder = SAM2ImageEncoder(
+            encoder_model_path, device, cuda_stream
+        )
         self.decoder = SAM2ImageDecoder(
-            decoder_model_path, device, self.encoder.input_shape[2:]
+            decoder_model_path,
+            device,
+            self.encoder.input_shape[2:],
+            cuda_stream=cuda_stream,
         )
 
-    def encode(self, cv_image: np.ndarray) -> List[np.ndarray]:
-        original_size = cv_image.shape[:2]
-        high_res_feats_0, high_res_feats_1, image_embed = self.encoder(
-            cv_image
+        # Image embeddings keyed by image content, so re-prompting the same
+        # image skips the encoder
+        self.embedding_cache = LRUCache(8)
+
+    def encode_input(self, original_size, input_tensor: np.ndarray) -> dict:
+        """Run the encoder on an already prepared input tensor."""
+        high_res_feats_0, high_res_feats_1, image_embed = (
+            self.encoder.process_output(
+                self.encoder.forward_encoder(input_tensor)
+            )
         )
         return {
             "high_res_feats_0": high_res_feats_0,
@@ -32,21 +56,70 @@ def encode(self, cv_image: np.ndarray) -> List[np.ndarray]:
             "original_size": original_size,
         }
 
-    def predict_masks(self, embedding, prompt) -> List[np.ndarray]:
-        points = []
-        labels = []
+    def encode(self, cv_image: np.ndarray) -> List[np.ndarray]:
+        key = get_embedding_key(cv_image)
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
+
+        embedding = self.encode_input(
+            cv_image.shape[:2], self.encoder.prepare_input(cv_image)
+        )
+        self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def encode_batch(self, cv_images: List[np.ndarray]) -> List[dict]:
+        """Encode several images. The next image is prepared on a worker
+        thread while the encoder session runs on the current one."""
+        keys = [get_embedding_key(cv_image) for cv_image in cv_images]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        pending = [i for i, embedding in enumerate(embeddings) if not embedding]
+        if not pending:
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(
+                self.encoder.prepare_input, cv_images[pending[0]]
+            )
+            for n, i in enumerate(pending):
+                input_tensor = future.result()
+                if n + 1 < len(pending):
+                    future = executor.submit(
+                        self.encoder.prepare_input, cv_images[pending[n + 1]]
+                    )
+                embeddings[i] = self.encode_input(
+                    cv_images[i].shape[:2], input_tensor
+                )
+                self.embedding_cache.put(keys[i], embeddings[i])
+        return embeddings
+
+    @staticmethod
+    def get_input_points(prompt) -> Tuple[np.ndarray, np.ndarray]:
+        """Get input points"""
+        num_points = 0
         for mark in prompt:
             if mark["type"] == "point":
-                points.append(mark["data"])
-                labels.append(mark["label"])
+                num_points += 1
             elif mark["type"] == "rectangle":
-                points.append([mark["data"][0], mark["data"][1]])  # top left
-                points.append(
-                    [mark["data"][2], mark["data"][3]]
-                )  # bottom right
-                labels.append(2)
-                labels.append(3)
-        points, labels = np.array(points), np.array(labels)
+                num_points += 2
+        points = np.empty((num_points, 2), dtype=np.float32)
+        labels = np.empty((num_points,), dtype=np.float32)
+        i = 0
+        for mark in prompt:
+            if mark["type"] == "point":
+                points[i] = mark["data"]
+                labels[i] = mark["label"]
+                i += 1
+            elif mark["type"] == "rectangle":
+                points[i] = mark["data"][:2]  # top left
+                points[i + 1] = mark["data"][2:4]  # bottom right
+                labels[i] = 2
+                labels[i + 1] = 3
+                i += 2
+        return points, labels
+
+    def predict_masks(self, embedding, prompt) -> List[np.ndarray]:
+        points, labels = self.get_input_points(prompt)
 
         image_embedding = embedding["image_embedding"]
         high_res_feats_0 = embedding["high_res_feats_0"]
@@ -65,38 +138,100 @@ def predict_masks(self, embedding, prompt) -> List[np.ndarray]:
 
     def transform_masks(self, masks, original_size, transform_matrix):
         """Transform the masks back to the original image size."""
-        output_masks = []
-        for batch in range(masks.shape[0]):
-            batch_masks = []
-            for mask_id in range(masks.shape[1]):
-                mask = masks[batch, mask_id]
-                mask = cv2.warpAffine(
-                    mask,
-                    transform_matrix[:2],
-                    (original_size[1], original_size[0]),
-                    flags=cv2.INTER_LINEAR,
-                )
-                batch_masks.append(mask)
-            output_masks.append(batch_masks)
-        return np.array(output_masks)
+        batch, num_masks, height, width = masks.shape
+        output_masks = np.empty(
+            (batch, num_masks, original_size[0], original_size[1]),
+            dtype=masks.dtype,
+        )
+        flat_masks = masks.reshape(-1, height, width)
+        flat_output_masks = output_masks.reshape(
+            -1, original_size[0], original_size[1]
+        )
+        for i in range(batch * num_masks):
+            cv2.warpAffine(
+                flat_masks[i],
+                transform_matrix[:2],
+                (original_size[1], original_size[0]),
+                dst=flat_output_masks[i],
+                flags=cv2.INTER_LINEAR,
+            )
+        return output_masks
+
+
+def get_providers(device: str, cuda_stream: int = None) -> list:
+    """Execution providers for the given device, optionally pinning the
+    CUDA provider to a user owned stream."""
+    if device.lower() != "gpu":
+        return ["CPUExecutionProvider"]
+    if cuda_stream is None:
+        return ["CUDAExecutionProvider"]
+    return [
+        (
+            "CUDAExecutionProvider",
+            {
+                "device_id": 0,
+                "user_compute_stream": str(cuda_stream),
+                "do_copy_in_default_stream": "1",
+            },
+        )
+    ]
+
+
+# The encoder and decoder use identical options, built once at import
+ort.set_default_logger_severity(3)
+SAM2_SESSION_OPTIONS = create_session_options()
+
+
+def bind_session_outputs(
+    session: ort.InferenceSession, io_binding, device_type: str
+) -> None:
+    """Bind every output of a session to the given device. Outputs with a
+    fully static float32 shape get a preallocated buffer that ORT reuses on
+    every run; the others are allocated by ORT."""
+    for output in session.get_outputs():
+        if output.type == "tensor(float)" and all(
+            isinstance(dim, int) for dim in output.shape
+        ):
+            io_binding.bind_ortvalue_output(
+                output.name,
+                ort.OrtValue.ortvalue_from_shape_and_type(
+                    output.shape, np.float32, device_type, 0
+                ),
+            )
+        else:
+            io_binding.bind_output(output.name, device_type)
 
 
 class SAM2ImageEncoder:
-    def __init__(self, path: str, device: str) -> None:
+    def __init__(
+        self, path: str, device: str, cuda_stream: int = None
+    ) -> None:
         # Initialize model
-        providers = ["CPUExecutionProvider"]
-        if device.lower() == "gpu":
-            providers = ["CUDAExecutionProvider"]
-        sess_options = ort.SessionOptions()
-        sess_options.log_severity_level = 3
+        providers = get_providers(device, cuda_stream)
+        self.device_type = "cuda" if device.lower() == "gpu" else "cpu"
         self.session = ort.InferenceSession(
-            path, providers=providers, sess_options=sess_options
+            path, providers=providers, sess_options=SAM2_SESSION_OPTIONS
         )
 
         # Get model info
         self.get_input_details()
         self.get_output_details()
 
+        # The binding (and its preallocated outputs) is shared, so the
+        # preload thread and request threads take turns on it
+        self.io_binding = self.session.io_binding()
+        self.io_binding_lock = threading.Lock()
+        if self.device_type == "cpu":
+            bind_session_outputs(
+                self.session, self.io_binding, self.device_type
+            )
+
+        # Fold (x / 255 - mean) / std into a per-channel scale and bias
+        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        self.scale = (1.0 / (255.0 * std)).reshape(3, 1, 1)
+        self.bias = (-mean / std).reshape(3, 1, 1)
+
     def __call__(
         self, image: np.ndarray
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -114,26 +249,56 @@ def encode_image(
     def prepare_input(self, image: np.ndarray) -> np.ndarray:
         self.img_height, self.img_width = image.shape[:2]
 
-        input_img = cv2.resize(image, (self.input_width, self.input_height))
+        if image.shape[:2] == (self.input_height, self.input_width):
+            input_img = image
+        else:
+            input_img = cv2.resize(
+                image, (self.input_width, self.input_height)
+            )
 
-        mean = np.array([0.485, 0.456, 0.406])
-        std = np.array([0.229, 0.224, 0.225])
-        input_img = (input_img / 255.0 - mean) / std
-        input_img = input_img.transpose(2, 0, 1)
-        input_tensor = input_img[np.newaxis, :, :, :].astype(np.float32)
+        # Normalize straight into a contiguous float32 NCHW buffer
+        input_tensor = np.empty(
+            (1, 3, self.input_height, self.input_width), dtype=np.float32
+        )
+        np.multiply(
+            input_img.transpose(2, 0, 1), self.scale, out=input_tensor[0]
+        )
+        np.add(input_tensor[0], self.bias, out=input_tensor[0])
 
-        return input_tensor
+        # FP16-converted encoders take half precision input
+        return input_tensor.astype(self.input_dtype, copy=False)
 
     def forward_encoder(self, input_tensor: np.ndarray) -> List[np.ndarray]:
-        outputs = self.session.run(
-            self.output_names, {self.input_names[0]: input_tensor}
-        )
+        with self.io_binding_lock:
+            self.io_binding.bind_cpu_input(self.input_names[0], input_tensor)
+            if self.device_type == "cuda":
+                # Rebind so ORT allocates fresh device buffers on every run;
+                # the features stay on the GPU (and in the embedding cache)
+                # and are handed to the decoder as OrtValues without a host
+                # round-trip
+                for name in self.output_names:
+                    self.io_binding.bind_output(name, self.device_type)
+                self.session.run_with_iobinding(self.io_binding)
+                if self.outputs_float32:
+                    return self.io_binding.get_outputs()
+                # FP16 features are cast on the host in process_output
+                return self.io_binding.copy_outputs_to_cpu()
+            self.session.run_with_iobinding(self.io_binding)
+            outputs = self.io_binding.copy_outputs_to_cpu()
 
         return outputs
 
     def process_output(
         self, outputs: List[np.ndarray]
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # The decoder always expects float32 features; device-resident
+        # OrtValues are only returned by float32 encoders
+        outputs = [
+            output.astype(np.float32, copy=False)
+            if isinstance(output, np.ndarray)
+            else output
+            for output in outputs
+        ]
         return outputs[0], outputs[1], outputs[2]
 
     def get_input_details(self) -> None:
@@ -145,12 +310,20 @@ def get_input_details(self) -> None:
         self.input_shape = model_inputs[0].shape
         self.input_height = self.input_shape[2]
         self.input_width = self.input_shape[3]
+        self.input_dtype = (
+            np.float16
+            if model_inputs[0].type == "tensor(float16)"
+            else np.float32
+        )
 
     def get_output_details(self) -> None:
         model_outputs = self.session.get_outputs()
         self.output_names = [
             model_outputs[i].name for i in range(len(model_outputs))
         ]
+        self.outputs_float32 = all(
+            output.type == "tensor(float)" for output in model_outputs
+        )
 
 
 class SAM2ImageDecoder:
@@ -161,15 +334,13 @@ def __init__(
         encoder_input_size: Tuple[int, int],
         orig_im_size: Tuple[int, int] = None,
         mask_threshold: float = 0.0,
+        cuda_stream: int = None,
     ) -> None:
         # Initialize model
-        providers = ["CPUExecutionProvider"]
-        if device.lower() == "gpu":
-            providers = ["CUDAExecutionProvider"]
-        sess_options = ort.SessionOptions()
-        sess_options.log_severity_level = 3
+        providers = get_providers(device, cuda_stream)
+        self.device_type = "cuda" if device.lower() == "gpu" else "cpu"
         self.session = ort.InferenceSession(
-            path, providers=providers, sess_options=sess_options
+            path, providers=providers, sess_options=SAM2_SESSION_OPTIONS
         )
 
         self.orig_im_size = (
@@ -179,10 +350,28 @@ def __init__(
         self.mask_threshold = mask_threshold
         self.scale_factor = 4
 
+        # Empty mask prompt for the common single-prompt case, reused
+        # across calls
+        self.mask_input = np.zeros(
+            (
+                1,
+                1,
+                self.encoder_input_size[0] // self.scale_factor,
+                self.encoder_input_size[1] // self.scale_factor,
+            ),
+            dtype=np.float32,
+        )
+        self.has_mask_input = np.zeros((1,), dtype=np.float32)
+
         # Get model info
         self.get_input_details()
         self.get_output_details()
 
+        # Shared binding, see SAM2ImageEncoder
+        self.io_binding = self.session.io_binding()
+        self.io_binding_lock = threading.Lock()
+        bind_session_outputs(self.session, self.io_binding, self.device_type)
+
     def __call__(
         self,
         image_embed: np.ndarray,
@@ -232,16 +421,13 @@ def prepare_inputs(
         )
 
         num_labels = input_point_labels.shape[0]
-        mask_input = np.zeros(
-            (
-                num_labels,
-                1,
-                self.encoder_input_size[0] // self.scale_factor,
-                self.encoder_input_size[1] // self.scale_factor,
-            ),
-            dtype=np.float32,
-        )
-        has_mask_input = np.array([0], dtype=np.float32)
+        if num_labels == 1:
+            mask_input = self.mask_input
+        else:
+            mask_input = np.zeros(
+                (num_labels,) + self.mask_input.shape[1:], dtype=np.float32
+            )
+        has_mask_input = self.has_mask_input
 
         return (
             image_embed,
@@ -259,8 +445,13 @@ def prepare_points(
         point_labels: Union[List[np.ndarray], np.ndarray],
     ) -> Tuple[np.ndarray, np.ndarray]:
         if isinstance(point_coords, np.ndarray):
-            input_point_coords = point_coords[np.newaxis, ...]
-            input_point_labels = point_labels[np.newaxis, ...]
+            # Copy, since the coords are normalized in place below
+            input_point_coords = np.array(
+                point_coords[np.newaxis, ...], dtype=np.float32
+            )
+            input_point_labels = np.asarray(
+                point_labels[np.newaxis, ...], dtype=np.float32
+            )
         else:
             max_num_points = max([coords.shape[0] for coords in point_coords])
             # We need to make sure that all inputs have the same number of points
@@ -279,29 +470,28 @@ def prepare_points(
                 input_point_coords[i, : coords.shape[0], :] = coords
                 input_point_labels[i, : labels.shape[0]] = labels
 
-        input_point_coords[..., 0] = (
-            input_point_coords[..., 0]
-            / self.orig_im_size[1]
-            * self.encoder_input_size[1]
-        )  # Normalize x
-        input_point_coords[..., 1] = (
-            input_point_coords[..., 1]
-            / self.orig_im_size[0]
-            * self.encoder_input_size[0]
-        )  # Normalize y
-
-        return input_point_coords.astype(
-            np.float32
-        ), input_point_labels.astype(np.float32)
+        # Normalize x and y
+        scale = np.array(
+            [
+                self.encoder_input_size[1] / self.orig_im_size[1],
+                self.encoder_input_size[0] / self.orig_im_size[0],
+            ],
+            dtype=np.float32,
+        )
+        np.multiply(input_point_coords, scale, out=input_point_coords)
+
+        return input_point_coords, input_point_labels
 
     def forward_decoder(self, inputs) -> List[np.ndarray]:
-        outputs = self.session.run(
-            self.output_names,
-            {
-                self.input_names[i]: inputs[i]
-                for i in range(len(self.input_names))
-            },
-        )
+        with self.io_binding_lock:
+            for name, value in zip(self.input_names, inputs):
+                if isinstance(value, ort.OrtValue):
+                    # Encoder features already resident on the device
+                    self.io_binding.bind_ortvalue_input(name, value)
+                else:
+                    self.io_binding.bind_cpu_input(name, value)
+            self.session.run_with_iobinding(self.io_binding)
+            outputs = self.io_binding.copy_outputs_to_cpu()
         return outputs
 
     def process_output(
@@ -325,9 +515,9 @@ def set_image_size(self, orig_im_size: Tuple[int, int]) -> None:
 
     def get_input_details(self) -> None:
         model_inputs = self.session.get_inputs()
-        self.input_names = [
+        self.input_names = tuple(
             model_inputs[i].name for i in range(len(model_inputs))
-        ]
+        )
 
     def get_output_details(self) -> None:
         model_outputs = self.session.get_outputs()
@@ -1,5 +1,7 @@
 
 
+import threading
+
 import cv2
 import onnxruntime
 import numpy as np
@@ -29,6 +31,35 @@ def __init__(self, encoder_model_path, decoder_model_path, target_size=1024, inp
             decoder_model_path, providers=providers
         )
 
+        # Bind decoder outputs once, inputs are rebound on every run. The
+        # masks are always decoded at self.input_size, so a statically
+        # single-mask output is written straight into a preallocated buffer.
+        # Concurrent requests take turns on the binding and the buffer
+        self.decoder_io_binding = self.decoder_session.io_binding()
+        self.decoder_lock = threading.Lock()
+        self.decoder_output_names = []
+        self.mask_buffer = None
+        for output in self.decoder_session.get_outputs():
+            self.decoder_output_names.append(output.name)
+            if (
+                output.name == "masks"
+                and len(output.shape) == 4
+                and output.shape[1] == 1
+            ):
+                self.mask_buffer = np.empty(
+                    (1, 1, *self.input_size), dtype=np.float32
+                )
+                self.decoder_io_binding.bind_output(
+                    output.name,
+                    "cpu",
+                    0,
+                    np.float32,
+                    self.mask_buffer.shape,
+                    self.mask_buffer.ctypes.data,
+                )
+            else:
+                self.decoder_io_binding.bind_output(output.name, "cpu")
+
     def get_input_points(self, prompt):
         """Get input points"""
         points = []
@@ -126,13 +157,21 @@ def run_decoder(
             "has_mask_input": onnx_has_mask_input,
             "orig_im_size": np.array(self.input_size, dtype=np.float32),
         }
-        masks, _, _ = self.decoder_session.run(None, decoder_inputs)
-
         # Transform the masks back to the original image size.
         inv_transform_matrix = np.linalg.inv(transform_matrix)
-        transformed_masks = self.transform_masks(
-            masks, original_size, inv_transform_matrix
-        )
+        with self.decoder_lock:
+            for name, value in decoder_inputs.items():
+                self.decoder_io_binding.bind_cpu_input(name, value)
+            self.decoder_session.run_with_iobinding(self.decoder_io_binding)
+            if self.mask_buffer is not None:
+                masks = self.mask_buffer
+            else:
+                outputs = self.decoder_io_binding.copy_outputs_to_cpu()
+                masks = outputs[self.decoder_output_names.index("masks")]
+            # Still under the lock, the buffer is copied out here
+            transformed_masks = self.transform_masks(
+                masks, original_size, inv_transform_matrix
+            )
 
         return transformed_masks
 
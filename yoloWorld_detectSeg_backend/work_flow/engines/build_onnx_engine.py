@@ -3,6 +3,44 @@
 import onnxruntime as ort
 
 
+_shared_cpu_allocator_registered = False
+
+
+def create_session_options(
+    shared_allocator: bool = False,
+) -> ort.SessionOptions:
+    """Session options tuned for single-process CPU inference. With
+    shared_allocator, CPU buffers come from one environment-level arena
+    instead of one arena per session."""
+    global _shared_cpu_allocator_registered
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = (
+        ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    )
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if "OMP_NUM_THREADS" in os.environ:
+        sess_opts.intra_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+    else:
+        sess_opts.intra_op_num_threads = os.cpu_count() or 1
+    sess_opts.enable_mem_pattern = True
+    sess_opts.enable_cpu_mem_arena = True
+    sess_opts.add_session_config_entry("session.intra_op.allow_spinning", "1")
+    if shared_allocator:
+        if not _shared_cpu_allocator_registered:
+            ort.create_and_register_allocator(
+                ort.OrtMemoryInfo(
+                    "Cpu",
+                    ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR,
+                    0,
+                    ort.OrtMemType.DEFAULT,
+                ),
+                ort.OrtArenaCfg(0, -1, -1, -1),
+            )
+            _shared_cpu_allocator_registered = True
+        sess_opts.add_session_config_entry("session.use_env_allocators", "1")
+    return sess_opts
+
+
 class OnnxBaseModel:
     def __init__(
         self, model_path, device_type: str = "cpu", log_severity_level: int = 3
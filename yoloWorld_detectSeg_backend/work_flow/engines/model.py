@@ -1,6 +1,8 @@
 import base64
+import copy
 import csv
-import glob
+import functools
+import json
 import logging
 import os
 import pathlib
@@ -11,24 +13,13 @@
 import onnx
 import urllib.request
 from urllib.parse import urlparse
-import re
 
 import ssl
 
-from PIL.Image import Image
-
 from work_flow.utils.label_file import LabelFile, LabelFileError
 
 from utils.backend_utils.colorprinter import print_red
 
-ssl._create_default_https_context = (
-    ssl._create_unverified_context
-)  # Prevent issue when downloading flows behind a proxy
-
-import socket
-
-socket.setdefaulttimeout(240)  # Prevent timeout when downloading flows
-
 from abc import abstractmethod
 
 from .types import AutoLabelingResult
@@ -46,6 +37,14 @@ class Model:
     )
     # home_dir = os.path.expanduser("E:/models/yanglao")
     home_dir = os.path.expanduser("E:\models\yanglao")
+    # ONNX files that passed onnx.checker, keyed by path -> [mtime_ns, size]
+    onnx_check_cache = None
+    onnx_check_cache_file = ".onnx_check_cache.json"
+    # Resolved model paths, keyed by (home_dir, name, local, online)
+    model_abs_path_cache = {}
+    # Parsed YAML configs, keyed by (path, mtime_ns)
+    config_cache = {}
+
     class Meta:
         required_config_names = []
         widgets = ["button_run"]
@@ -62,8 +61,7 @@ def __init__(self, model_config, on_message) -> None:
             if not os.path.isfile(model_config):
                 self.on_message("Config file not found: {model_config}"
                                 .format(model_config=model_config))
-            with open(model_config, "r") as f:
-                self.config = yaml.safe_load(f)
+            self.config = self.load_config(model_config)
         elif isinstance(model_config, dict):
             self.config = model_config
         else:
@@ -75,6 +73,21 @@ def __init__(self, model_config, on_message) -> None:
         # )
         self.output_mode = self.Meta.default_output_mode
 
+    @staticmethod
+    def load_config(config_path):
+        """
+        Load a YAML config file. Parsed configs are cached by path and
+        modification time; each caller gets its own copy to modify.
+        """
+        key = (config_path, os.stat(config_path).st_mtime_ns)
+        config = Model.config_cache.get(key)
+        if config is None:
+            loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            with open(config_path, "r") as f:
+                config = yaml.load(f, Loader=loader)
+            Model.config_cache[key] = config
+        return copy.deepcopy(config)
+
     def get_required_widgets(self):
         """
         Get required widgets for showing in UI
@@ -82,26 +95,114 @@ def get_required_widgets(self):
         return self.Meta.widgets
 
     def allow_migrate_data(self):
-        home_dir = os.path.expanduser("~")
+        allowed, error = self.migrate_data(os.path.expanduser("~"))
+        if error is not None:
+            self.on_message(f"An error occurred during data migration: {error}")
+        return allowed
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def migrate_data(home_dir):
+        """
+        Migrate anylabeling_data to xanylabeling_data under home_dir. The
+        layout does not change within a process, so the result is cached.
+        Returns (allowed, error message or None).
+        """
         old_model_path = os.path.join(home_dir, "anylabeling_data")
         new_model_path = os.path.join(home_dir, "xanylabeling_data")
 
         if os.path.exists(new_model_path) or not os.path.exists(
             old_model_path
         ):
-            return True
+            return True, None
 
         # Check if the current env have write permissions
         if not os.access(home_dir, os.W_OK):
-            return False
+            return False, None
 
         # Attempt to migrate data
         try:
             os.rename(old_model_path, new_model_path)
-            return True
+            return True, None
         except Exception as e:
-            self.on_message(f"An error occurred during data migration: {str(e)}")
+            return False, str(e)
+
+    def check_onnx_model(self, model_abs_path):
+        """
+        Validate an ONNX model with onnx.checker, skipping the check when the
+        file is unchanged since it last passed. An invalid model is deleted
+        so that it gets redownloaded. Returns True if the model is valid.
+        """
+        stat = os.stat(model_abs_path)
+        signature = [stat.st_mtime_ns, stat.st_size]
+        cache_path = os.path.join(self.home_dir, self.onnx_check_cache_file)
+        if Model.onnx_check_cache is None:
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    Model.onnx_check_cache = json.load(f)
+            except (OSError, ValueError):
+                Model.onnx_check_cache = {}
+        if Model.onnx_check_cache.get(model_abs_path) == signature:
+            return True
+
+        try:
+            onnx.checker.check_model(model_abs_path)
+        except onnx.checker.ValidationError as e:
+            Model.onnx_check_cache.pop(model_abs_path, None)
+            self.on_message(f"{str(e)}")
+            self.on_message("Action: Delete and redownload...")
+            try:
+                os.remove(model_abs_path)
+            except Exception as e:  # noqa
+                self.on_message(f"Could not delete: {str(e)}")
+            return False
+
+        Model.onnx_check_cache[model_abs_path] = signature
+        try:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(Model.onnx_check_cache, f)
+        except OSError:
+            pass  # The in-process cache still applies
+        return True
+
+    def check_model_file(self, model_abs_path):
+        """
+        Check that a model file in the data dir exists and, for ONNX models,
+        passes check_onnx_model (which deletes it otherwise).
+        """
+        if not os.path.exists(model_abs_path):
             return False
+        return not model_abs_path.lower().endswith(
+            ".onnx"
+        ) or self.check_onnx_model(model_abs_path)
+
+    def get_quantized_model_abs_path(self, model_abs_path):
+        """
+        Get the INT8 dynamically quantized copy of an ONNX model, creating it
+        next to the FP32 model on first use. Falls back to the FP32 model if
+        quantization is unavailable or fails.
+        """
+        quantized_path = os.path.splitext(model_abs_path)[0] + ".int8.onnx"
+        if (
+            os.path.exists(quantized_path)
+            and os.path.getmtime(quantized_path)
+            >= os.path.getmtime(model_abs_path)
+        ):
+            return quantized_path
+
+        self.on_message(f"Quantizing {model_abs_path} to INT8...")
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(
+                model_abs_path, quantized_path, weight_type=QuantType.QInt8
+            )
+        except Exception as e:  # noqa
+            self.on_message(f"Could not quantize {model_abs_path}: {e}")
+            if os.path.exists(quantized_path):
+                os.remove(quantized_path)
+            return model_abs_path
+        return quantized_path
 
     @staticmethod
     def check_model_shards(model_path):
@@ -118,8 +219,19 @@ def check_model_shards(model_path):
         model_dir = os.path.dirname(model_path)
         base_name = os.path.splitext(os.path.basename(model_path))[0]
 
+        # 只遍历一次目录，后续的 .csv 查找和分片检查都复用这些目录项
+        try:
+            with os.scandir(model_dir or '.') as it:
+                entries = {entry.name: entry for entry in it}
+        except OSError:
+            entries = {}
+
         # 搜索目录下的任何 .csv 文件
-        csv_files = glob.glob(os.path.join(model_dir, '*.csv'))
+        csv_files = [
+            entry.path
+            for name, entry in entries.items()
+            if name.endswith('.csv') and not name.startswith('.')
+        ]
         if not csv_files:
             print("未找到任何 .csv 文件。")
             return False
@@ -128,14 +240,20 @@ def check_model_shards(model_path):
         shard_files = []
         for csv_file in csv_files:
             with open(csv_file, mode='r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
+                reader = csv.reader(file)
+                # 只读取一次表头，定位 filename 和 filesize 两列
+                header = next(reader, None)
+                if (header is None or 'filename' not in header
+                        or 'filesize' not in header):
+                    continue
+                name_index = header.index('filename')
+                size_index = header.index('filesize')
                 for row in reader:
-                    filename = row['filename']
-                    expected_filesize = int(row['filesize'])
+                    filename = row[name_index]
 
                     # 过滤出与主文件 basename 匹配的分片文件
                     if filename.startswith(base_name):
-                        shard_files.append((filename, expected_filesize))
+                        shard_files.append((filename, int(row[size_index])))
 
         # 检查是否找到相关的分片文件
         if not shard_files:
@@ -145,16 +263,16 @@ def check_model_shards(model_path):
         # 检查每个分片文件是否存在以及文件大小是否匹配
         all_files_exist = True
         for filename, expected_filesize in shard_files:
-            file_path = os.path.join(model_dir, filename)
+            entry = entries.get(filename)
 
             # 检查文件是否存在
-            if not os.path.exists(file_path):
+            if entry is None:
                 print(f"文件 {filename} 不存在。")
                 all_files_exist = False
                 continue
 
             # 检查文件大小是否匹配
-            actual_filesize = os.path.getsize(file_path)
+            actual_filesize = entry.stat().st_size
             if actual_filesize != expected_filesize:
                 print(f"文件 {filename} 大小不匹配。预期: {expected_filesize}字节，实际: {actual_filesize}字节")
                 all_files_exist = False
@@ -177,11 +295,14 @@ def convert_to_wsl_path(win_path):
         Returns:
             str: 转换后的 WSL 路径，如果路径无效则返回 None。
         """
-        # 正则表达式匹配 Windows 路径格式（例如 C:\path\to\file）
-        windows_path_pattern = r'^[a-zA-Z]:\\.*'
-
-        # 检查输入是否符合 Windows 路径格式
-        if re.match(windows_path_pattern, win_path):
+        # 检查输入是否符合 Windows 路径格式（例如 C:\path\to\file）
+        # 直接比较前三个字符，无需正则表达式
+        if (
+            len(win_path) >= 3
+            and win_path[0].isascii()
+            and win_path[0].isalpha()
+            and win_path[1:3] == ':\\'
+        ):
             # 提取盘符并转换为小写（例如 "C:" -> "c"）
             drive_letter = win_path[0].lower()
             # 去除盘符，替换 \ 为 /，生成 WSL 路径
@@ -197,7 +318,42 @@ def convert_to_wsl_path(win_path):
 
     def get_model_abs_path(self, model_config, model_path_field_name):
         """
-        Get model absolute path from config path or download from url
+        Get model absolute path from config path or download from url.
+        Resolved paths are memoized, so later loads of the same model skip
+        the filesystem and ONNX probing while the file (or, for sharded
+        models, its shards) still exists.
+        """
+        model_path = model_config[model_path_field_name]
+        key = (
+            self.home_dir,
+            model_config.get("name"),
+            model_path.get("local", None),
+            model_path.get("online", None),
+        )
+        cached = Model.model_abs_path_cache.get(key)
+        if cached is not None:
+            model_abs_path, sharded = cached
+            if (
+                self.check_model_shards(model_abs_path)
+                if sharded
+                else os.path.exists(model_abs_path)
+            ):
+                return model_abs_path
+
+        model_abs_path = self.resolve_model_abs_path(
+            model_config, model_path_field_name
+        )
+        if model_abs_path is not None:
+            # A path without a file of its own was resolved as shards
+            Model.model_abs_path_cache[key] = (
+                model_abs_path,
+                not os.path.exists(model_abs_path),
+            )
+        return model_abs_path
+
+    def resolve_model_abs_path(self, model_config, model_path_field_name):
+        """
+        Resolve model absolute path from config path or download from url
         """
         # Try getting model path from config folder
         model_path = model_config[model_path_field_name]
@@ -209,43 +365,30 @@ def get_model_abs_path(self, model_config, model_path_field_name):
         model_path = os.path.abspath(os.path.join(self.home_dir, data_dir))
         # Model path is a local path
         if local is not None and local.strip() != "":
-            model_abs_path = local
-            if (os.path.exists(model_abs_path)
-                or self.check_model_shards(model_abs_path)
-            ):
-                return model_abs_path
-            else:
-                model_abs_path = self.convert_to_wsl_path(model_abs_path)
-                if (os.path.exists(model_abs_path)
-                        or self.check_model_shards(model_abs_path)
+            # The path as given or mapped to WSL may be a single file or a
+            # sharded model; the WSL mapping is only tried if needed
+            def iter_local_candidates():
+                yield local
+                yield self.convert_to_wsl_path(local)
+
+            for candidate in iter_local_candidates():
+                if candidate is not None and (
+                    os.path.exists(candidate)
+                    or self.check_model_shards(candidate)
                 ):
-                    return model_abs_path
-                else:
-                    local_filename = os.path.basename(local)
-                    local_model_abs_path = os.path.abspath(
-                        os.path.join(
-                            model_path,
-                            "flows",
-                            model_config["name"],
-                            local_filename,
-                        )
-                    )
-                    if os.path.exists(local_model_abs_path):
-                        print(local_model_abs_path)
-                        if local_model_abs_path.lower().endswith(".onnx"):
-                            try:
-                                onnx.checker.check_model(local_model_abs_path)
-                            except onnx.checker.ValidationError as e:
-                                self.on_message(f"{str(e)}")
-                                self.on_message("Action: Delete and redownload...")
-                                try:
-                                    os.remove(local_model_abs_path)
-                                except Exception as e:  # noqa
-                                    self.on_message(f"Could not delete: {str(e)}")
-                            else:
-                                return local_model_abs_path
-                        else:
-                            return local_model_abs_path
+                    return candidate
+
+            # Fall back to a copy of the same file in the data dir
+            local_model_abs_path = os.path.abspath(
+                os.path.join(
+                    model_path,
+                    "flows",
+                    model_config["name"],
+                    os.path.basename(local),
+                )
+            )
+            if self.check_model_file(local_model_abs_path):
+                return local_model_abs_path
 
             self.on_message("Model path not found: {model_path}".format(model_path=local))
 
@@ -269,21 +412,8 @@ def get_filename_from_url(url):
                     filename,
                 )
             )
-            if os.path.exists(model_abs_path):
-                if model_abs_path.lower().endswith(".onnx"):
-                    try:
-                        onnx.checker.check_model(model_abs_path)
-                    except onnx.checker.ValidationError as e:
-                        self.on_message(f"{str(e)}")
-                        self.on_message("Action: Delete and redownload...")
-                        try:
-                            os.remove(model_abs_path)
-                        except Exception as e:  # noqa
-                            self.on_message(f"Could not delete: {str(e)}")
-                    else:
-                        return model_abs_path
-                else:
-                    return model_abs_path
+            if self.check_model_file(model_abs_path):
+                return model_abs_path
 
             pathlib.Path(model_abs_path).parent.mkdir(parents=True, exist_ok=True)
 
@@ -296,17 +426,34 @@ def get_filename_from_url(url):
 
             self.on_message(f"Downloading {ellipsis_download_url} to {model_abs_path}")
             try:
-                # Download and show progress
-                def _progress(count, block_size, total_size):
-                    percent = int(count * block_size * 100 / total_size)
-                    self.on_message(
-                        "Downloading {download_url}: {percent}%".format(
-                            download_url=ellipsis_download_url, percent=percent
-                        )
-                    )
-                urllib.request.urlretrieve(
-                    download_url, model_abs_path, reporthook=_progress
-                )
+                # Download in 1 MB chunks and only report when the percent
+                # changes. The unverified context (this request only)
+                # prevents issues when downloading flows behind a proxy
+                with urllib.request.urlopen(
+                    download_url,
+                    timeout=240,
+                    context=ssl._create_unverified_context(),
+                ) as response, open(model_abs_path, "wb") as f:
+                    total_size = int(response.headers.get("Content-Length", 0))
+                    downloaded = 0
+                    last_percent = -1
+                    while True:
+                        chunk = response.read(1 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if not total_size:
+                            continue
+                        percent = downloaded * 100 // total_size
+                        if percent != last_percent:
+                            last_percent = percent
+                            self.on_message(
+                                "Downloading {download_url}: {percent}%".format(
+                                    download_url=ellipsis_download_url,
+                                    percent=percent,
+                                )
+                            )
             except Exception as e:  # noqa
                 self.on_message(f"Could not download {download_url}: {e}")
                 return None
@@ -348,16 +495,20 @@ def load_image_from_filename(filename):
         Returns:
             numpy.ndarray: 处理后的图像，格式为 8 位 RGB。
         """
-        label_file_path = os.path.splitext(filename)[0] + ".json"
+        # 标签文件路径本身带有标签后缀，只需一次 isfile 探测即可
+        label_file_path = os.path.splitext(filename)[0] + LabelFile.suffix
         image_data = None
         # 尝试从标签文件加载 imageData
-        if os.path.exists(label_file_path) and LabelFile.is_label_file(label_file_path):
+        if os.path.isfile(label_file_path):
             try:
                 label_file = LabelFile(label_file_path)
                 if label_file.image_data is not None:
-                    # 如果 imageData 存在，尝试解码 base64
+                    # 如果 imageData 存在，尝试解码 base64，直接得到 uint8 数组
                     try:
-                        image_data = base64.b64decode(label_file.image_data)
+                        image_data = np.frombuffer(
+                            base64.b64decode(label_file.image_data),
+                            dtype=np.uint8,
+                        )
                     except (binascii.Error, TypeError) as e:
                         logging.error(f"解码 base64 图像数据时出错，文件 {label_file_path}: {e}")
                         image_data = None
@@ -375,9 +526,29 @@ def load_image_from_filename(filename):
             except Exception as e:
                 logging.error(f"加载图像文件 {filename} 时出错: {e}")
                 return None
-        # 将图像数据转换为 NumPy 数组
-        image_array = np.frombuffer(image_data, dtype=np.uint8)
-        # 使用 OpenCV 解码图像
+        if image_data is None:
+            logging.error(f"加载图像文件 {filename} 时出错")
+            return None
+        # 将图像文件的字节数据转换为 NumPy 数组（标签文件分支已是数组）
+        if isinstance(image_data, np.ndarray):
+            image_array = image_data
+        else:
+            image_array = np.frombuffer(image_data, dtype=np.uint8)
+        # 常见情况：直接解码为 3 通道 BGR（保留位深），灰度和透明通道在解码时处理；
+        # 与 IMREAD_UNCHANGED 一致，不按 EXIF 方向旋转
+        cv_image = cv2.imdecode(
+            image_array,
+            cv2.IMREAD_COLOR
+            | cv2.IMREAD_ANYDEPTH
+            | cv2.IMREAD_IGNORE_ORIENTATION,
+        )
+        if cv_image is not None:
+            # 将图像转换为 8 位无符号整数类型
+            if cv_image.dtype != np.uint8:
+                cv_image = cv2.normalize(cv_image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+            # BGR 图像原地转换为 RGB
+            return cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB, dst=cv_image)
+        # 回退：按原始格式解码，再根据通道数处理
         cv_image = cv2.imdecode(image_array, cv2.IMREAD_UNCHANGED)
         if cv_image is None:
             logging.error(f"解码图像数据时出错，文件 {filename}")
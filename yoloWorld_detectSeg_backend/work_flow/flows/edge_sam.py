@@ -10,7 +10,7 @@
 from . import AutoLabelingResult
 from . import Shape
 
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 from work_flow.engines.model import Model
 from ..__base__.clip import ChineseClipONNX
 from ..__base__.edge_sam import EdgeSAMONNX
@@ -14,7 +14,7 @@
 from . import AutoLabelingResult
 from . import Shape
 
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 
 
 class SamEncoder:
@@ -17,7 +17,7 @@
 from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args, Grounding_DINO
 from .cbiaformer_cls import CBIAFORMER_CLS
 from .grounding_sam import GroundingSAM
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 from .yolov6_face import YOLOv6Face
 from ..__base__.sam_hq import SegmentAnythingHQONNX
 from ..utils import xyxyxyxy_to_xyxy
@@ -13,7 +13,7 @@
 
 
 from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 from ..__base__.sam_hq import SegmentAnythingHQONNX
 
 
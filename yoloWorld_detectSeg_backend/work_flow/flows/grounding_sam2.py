@@ -7,7 +7,7 @@
 from typing import Dict
 from tokenizers import Tokenizer
 from PyQt5.QtCore import QCoreApplication
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 from . import __preferred_device__, Model, AutoLabelingResult, Shape, OnnxBaseModel, Args, configs, SegmentAnything2ONNX
 
 
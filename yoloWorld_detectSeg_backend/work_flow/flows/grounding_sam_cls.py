@@ -16,7 +16,7 @@
 from .cbiaformer_cls import CBIAFORMER_CLS
 from .deit_cls import DEIT_CLS
 from .grounding_sam import GroundingSAM
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 from ..__base__.sam_hq import SegmentAnythingHQONNX
 from ..utils.image import crop_polygon_object
 
@@ -45,14 +45,18 @@ def __init__(self, config_path, on_message) -> None:
         on_message(f"Model loaded successfully, using device: {__preferred_device__}")
 
     def pre_process(self, image, inpainting_mask):
+        # 下面只做 resize（返回新图像），无需复制输入
         if isinstance(image, Image.Image):
-            imagex = image.copy()
+            imagex = image
         else:
             imagex = Image.fromarray(image)
-        if isinstance(inpainting_mask, Image.Image):
-            maskx = inpainting_mask.convert("L").copy()  # 确保 mask 是单通道
+        if not isinstance(inpainting_mask, Image.Image):
+            inpainting_mask = Image.fromarray(inpainting_mask)
+        # 确保 mask 是单通道，已是 L 模式时不再转换
+        if inpainting_mask.mode == "L":
+            maskx = inpainting_mask
         else:
-            maskx = Image.fromarray(inpainting_mask).convert("L")
+            maskx = inpainting_mask.convert("L")
 
         # 调整大小并准备输入
         if self.use_onnx:
@@ -4,6 +4,7 @@
 
 
 from . import __preferred_device__, Shape, Model, AutoLabelingResult, TextSystem, is_possible_rectangle
+from ..engines.build_onnx_engine import create_session_options
 
 
 class Args:
@@ -30,6 +31,82 @@ class Meta:
         }
         default_output_mode = "rectangle"
 
+    configs_dir = os.path.join(os.path.dirname(__file__), "../configs/ppocr")
+
+    # Arguments that do not depend on the instance, built once per class;
+    # parse_args only adds the sessions and per-config options
+    STATIC_ARGS = dict(
+        use_onnx=True,
+        # params for prediction engine
+        use_gpu=True,
+        use_xpu=False,
+        use_npu=False,
+        ir_optim=True,
+        use_tensorrt=False,
+        min_subgraph_size=15,
+        precision="fp32",
+        gpu_mem=500,
+        gpu_id=0,
+        # params for text detector
+        page_num=0,
+        det_limit_side_len=960,
+        det_limit_type="max",
+        det_box_type="quad",
+        # DB parmas
+        det_db_thresh=0.3,
+        det_db_box_thresh=0.6,
+        det_db_unclip_ratio=1.5,
+        max_batch_size=10,
+        use_dilation=False,
+        det_db_score_mode="fast",
+        # EAST parmas
+        det_east_score_thresh=0.8,
+        det_east_cover_thresh=0.1,
+        det_east_nms_thresh=0.2,
+        # SAST parmas
+        det_sast_score_thresh=0.5,
+        det_sast_nms_thresh=0.2,
+        # PSE parmas
+        det_pse_thresh=0,
+        det_pse_box_thresh=0.85,
+        det_pse_min_area=16,
+        det_pse_scale=1,
+        # FCE parmas
+        scales=[8, 16, 32],
+        alpha=1.0,
+        beta=1.0,
+        fourier_degree=5,
+        # params for text recognizer
+        rec_image_inverse=True,
+        rec_image_shape="3, 48, 320",
+        rec_batch_num=6,
+        max_text_length=25,
+        use_space_char=True,
+        # params for e2e
+        e2e_algorithm="PGNet",
+        e2e_model_dir="",
+        e2e_limit_side_len=768,
+        e2e_limit_type="max",
+        # PGNet parmas
+        e2e_pgnet_score_thresh=0.5,
+        e2e_pgnet_valid_set="totaltext",
+        e2e_pgnet_mode="fast",
+        # params for text classifier
+        cls_image_shape="3, 48, 192",
+        label_list=["0", "180"],
+        cls_batch_num=6,
+        cls_thresh=0.9,
+        enable_mkldnn=False,
+        cpu_threads=10,
+        use_pdserving=False,
+        warmup=False,
+        # SR parmas
+        sr_model_dir="",
+        sr_image_shape="3, 32, 128",
+        sr_batch_num=1,
+        e2e_char_dict_path=os.path.join(configs_dir, "ppocr_ic15_dict.txt"),
+    )
+
     def load_model(self, model_name):
         model_abs_path = self.get_model_abs_path(self.config, model_name)
 
@@ -40,16 +117,9 @@ def load_model(self, model_name):
             raise FileNotFoundError(
                 f"Could not download or initialize {model_task} model."
             )
+        if self.config.get("quantize", False):
+            model_abs_path = self.get_quantized_model_abs_path(model_abs_path)
 
-        self.sess_opts = ort.SessionOptions()
-        if "OMP_NUM_THREADS" in os.environ:
-            self.sess_opts.inter_op_num_threads = int(
-                os.environ["OMP_NUM_THREADS"]
-            )
-        self.providers = ["CPUExecutionProvider"]
-
-        if __preferred_device__ == "GPU":
-            self.providers = ["CUDAExecutionProvider"]
         net = ort.InferenceSession(
             model_abs_path,
             providers=self.providers,
@@ -61,6 +131,11 @@ def __init__(self, model_config, on_message) -> None:
         # Run the parent class's init method
         super().__init__(model_config, on_message)
 
+        # One set of options and providers for all three sessions
+        self.sess_opts = create_session_options(shared_allocator=True)
+        self.providers = ["CPUExecutionProvider"]
+        if __preferred_device__ == "GPU":
+            self.providers = ["CUDAExecutionProvider"]
         self.det_net = self.load_model("det_model_path")
         self.rec_net = self.load_model("rec_model_path")
         self.cls_net = self.load_model("cls_model_path")
@@ -68,7 +143,6 @@ def __init__(self, model_config, on_message) -> None:
         self.rec_algorithm = self.config.get("rec_algorithm", "SVTR_LCNet")
         self.drop_score = self.config.get("drop_score", 0.5)
         self.use_angle_cls = self.config["use_angle_cls"]
-        self.current_dir = os.path.dirname(__file__)
         self.lang = self.config.get("lang", "ch")
         if self.lang == "ch":
             self.rec_char_dict = "ppocr_keys_v1.txt"
@@ -79,125 +153,43 @@ def __init__(self, model_config, on_message) -> None:
         self.text_sys = TextSystem(self.args)
 
     def parse_args(self):
-        args = Args(  # 关键参数直接写死，你妈是不是死了？
-            use_onnx=True,
-            # params for prediction engine
-            use_gpu=True,
-            use_xpu=False,
-            use_npu=False,
-            ir_optim=True,
-            use_tensorrt=False,
-            min_subgraph_size=15,
-            precision="fp32",
-            gpu_mem=500,
-            gpu_id=0,
-            # params for text detector
-            page_num=0,
+        return Args(
+            **self.STATIC_ARGS,
             det_algorithm=self.det_algorithm,
             det_model=self.det_net,
-            det_limit_side_len=960,
-            det_limit_type="max",
-            det_box_type="quad",
-            # DB parmas
-            det_db_thresh=0.3,
-            det_db_box_thresh=0.6,
-            det_db_unclip_ratio=1.5,
-            max_batch_size=10,
-            use_dilation=False,
-            det_db_score_mode="fast",
-            # EAST parmas
-            det_east_score_thresh=0.8,
-            det_east_cover_thresh=0.1,
-            det_east_nms_thresh=0.2,
-            # SAST parmas
-            det_sast_score_thresh=0.5,
-            det_sast_nms_thresh=0.2,
-            # PSE parmas
-            det_pse_thresh=0,
-            det_pse_box_thresh=0.85,
-            det_pse_min_area=16,
-            det_pse_scale=1,
-            # FCE parmas
-            scales=[8, 16, 32],
-            alpha=1.0,
-            beta=1.0,
-            fourier_degree=5,
-            # params for text recognizer
             rec_algorithm=self.rec_algorithm,
             rec_model=self.rec_net,
-            rec_image_inverse=True,
-            rec_image_shape="3, 48, 320",
-            rec_batch_num=6,
-            max_text_length=25,
             rec_char_dict_path=os.path.join(
-                self.current_dir, f"../configs/ppocr/{self.rec_char_dict}"
+                self.configs_dir, self.rec_char_dict
             ),
-            use_space_char=True,
             drop_score=self.drop_score,
-            # params for e2e
-            e2e_algorithm="PGNet",
-            e2e_model_dir="",
-            e2e_limit_side_len=768,
-            e2e_limit_type="max",
-            # PGNet parmas
-            e2e_pgnet_score_thresh=0.5,
-            e2e_char_dict_path=os.path.join(
-                self.current_dir, "../configs/ppocr/ppocr_ic15_dict.txt"
-            ),
-            e2e_pgnet_valid_set="totaltext",
-            e2e_pgnet_mode="fast",
-            # params for text classifier
             use_angle_cls=self.use_angle_cls,
             cls_model=self.cls_net,
-            cls_image_shape="3, 48, 192",
-            label_list=["0", "180"],
-            cls_batch_num=6,
-            cls_thresh=0.9,
-            enable_mkldnn=False,
-            cpu_threads=10,
-            use_pdserving=False,
-            warmup=False,
-            # SR parmas
-            sr_model_dir="",
-            sr_image_shape="3, 32, 128",
-            sr_batch_num=1,
         )
-        return args
 
     def pack_results(self, dt_boxes, rec_res, scores):
-        results = [
-            {
-                "description": rec_res[i][0],
-                "points": np.array(dt_boxes[i]).astype(np.int32).tolist(),
-                "score": float(scores[i]),
-            }
-            for i in range(len(dt_boxes))
-        ]
+        # Cast every quad box to int32 in one go instead of once per box
+        boxes = np.asarray(dt_boxes, dtype=np.int32).tolist()
 
         shapes = []
-        for i, res in enumerate(results):
-            score = res["score"]
-            points = res["points"]
-            description = res["description"]
+        for i, points in enumerate(boxes):
             shape_type = (
                 "rectangle" if is_possible_rectangle(points) else "polygon"
             )
             shape = Shape(
                 label="text",
-                score=score,
+                score=float(scores[i]),
                 shape_type=shape_type,
-                group_id=int(i),
-                description=description,
+                group_id=i,
+                description=rec_res[i][0],
             )
             if shape_type == "rectangle":
-                pt1, pt2, pt3, pt4 = points
-                pt2 = [pt3[0], pt1[1]]
-                pt4 = [pt1[0], pt3[1]]
+                pt1, _, pt3, _ = points
                 shape.add_point(*pt1)
-                shape.add_point(*pt2)
+                shape.add_point(pt3[0], pt1[1])
                 shape.add_point(*pt3)
-                shape.add_point(*pt4)
-            elif shape_type == "polygon":
+                shape.add_point(pt1[0], pt3[1])
+            else:
                 for point in points:
                     shape.add_point(*point)
                 shape.closed = True
@@ -1,7 +1,9 @@
 import os
 import cv2
+import logging
 import numpy as np
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
 from work_flow.app_info import __preferred_device__
 from work_flow.engines.model import Model
@@ -38,6 +40,8 @@ def __init__(self, model_config, on_message) -> None:
         self.net = OnnxBaseModel(model_abs_path, __preferred_device__)
         self.input_shape = self.net.get_input_shape()[-2:]
         self.device = "cuda" if __preferred_device__ == "GPU" else "cpu"
+        # PNG encoding and disk writes run off the inference thread
+        self.save_executor = ThreadPoolExecutor(max_workers=2)
 
     def preprocess(self, image: np.ndarray) -> np.ndarray:
         """
@@ -49,15 +53,20 @@ def preprocess(self, image: np.ndarray) -> np.ndarray:
         Returns:
             np.ndarray: Preprocessed image.
         """
-        if len(image.shape) < 3:
-            image = np.expand_dims(image, axis=2)
         image = cv2.resize(
             image, self.input_shape, interpolation=cv2.INTER_LINEAR
         )
-        image = image.astype(np.float32) / 255.0
-        image = (image - 0.5) / 1.0
-        image = np.transpose(image, (2, 0, 1))
-        return np.expand_dims(image, axis=0)
+        if len(image.shape) < 3:
+            image = np.expand_dims(image, axis=2)
+        # (x / 255.0 - 0.5) / 1.0 folded into one subtract and one scale,
+        # written straight into the float32 NCHW blob
+        height, width, channels = image.shape
+        blob = np.empty((1, channels, height, width), dtype=np.float32)
+        np.subtract(
+            image.transpose(2, 0, 1), 127.5, out=blob[0], dtype=np.float32
+        )
+        np.multiply(blob[0], 1.0 / 255.0, out=blob[0])
+        return blob
 
     def forward(self, blob):
         return self.net.get_ort_inference(blob, extract=True, squeeze=True)
@@ -80,9 +89,10 @@ def postprocess(
             original_size[::-1],
             interpolation=cv2.INTER_LINEAR,
         )
-        max_val, min_val = np.max(result), np.min(result)
-        result = (result - min_val) / (max_val - min_val)
-        return (result * 255).astype(np.uint8)
+        # Min-max stretch to [0, 255] and cast to uint8 in one call
+        return cv2.normalize(
+            result, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U
+        )
 
     def predict_shapes(self, image, image_path=None):
         """
@@ -99,15 +109,12 @@ def predict_shapes(self, image, image_path=None):
         output = self.forward(blob)
         result_image = self.postprocess(output, image.shape[:2])
 
-        # Create the final image with transparent background
-        pil_mask = Image.fromarray(result_image)
-        pil_image = Image.open(image_path)
-        pil_image = pil_image.convert("RGBA")
-        pil_mask = pil_mask.convert("L")
-
-        # Create a new image with an alpha channel
-        output_image = Image.new("RGBA", pil_image.size, (0, 0, 0, 0))
-        output_image.paste(pil_image, (0, 0), pil_mask)
+        # Create the final image with the mask as its alpha channel
+        height, width = image.shape[:2]
+        rgba = np.empty((height, width, 4), dtype=np.uint8)
+        rgba[..., :3] = image
+        rgba[..., 3] = result_image
+        output_image = Image.fromarray(rgba, "RGBA")
 
         # Save the result
         image_dir_path = os.path.dirname(image_path)
@@ -117,9 +124,24 @@ def predict_shapes(self, image, image_path=None):
         image_file_name = os.path.basename(image_path)
         save_name = os.path.splitext(image_file_name)[0] + ".png"
         save_file = os.path.join(save_path, save_name)
-        output_image.save(save_file)
+        future = self.save_executor.submit(
+            output_image.save, save_file, compress_level=1
+        )
+
+        def log_save_error(future):
+            # The save runs off this thread, so report its errors here
+            if not future.cancelled() and future.exception() is not None:
+                logging.error(
+                    "Could not save matting result %s: %s",
+                    save_file,
+                    future.exception(),
+                )
+
+        future.add_done_callback(log_save_error)
 
         return AutoLabelingResult([], replace=False)
 
     def unload(self):
+        # Let pending PNG writes finish before releasing the model
+        self.save_executor.shutdown(wait=True)
         del self.net
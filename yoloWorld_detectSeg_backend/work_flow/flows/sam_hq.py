@@ -1,5 +1,6 @@
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import traceback
@@ -13,8 +14,56 @@
 from . import __preferred_device__, Shape, AutoLabelingResult, ChineseClipONNX, LRUCache
 from ..__base__.sam_hq import SegmentAnythingHQONNX
 from ..engines.model import Model
-
-
+from ..utils.label_file import LabelFile
+from ..utils.lru_cache import get_embedding_key
+
+try:
+    import numba
+except ImportError:  # optional, fall back to OpenCV / NumPy
+    numba = None
+
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def filter_contours(points, offsets, image_size):
+        """Filter contours stored as one Nx2 int32 point array split at
+        offsets: drop contours covering >90% of the image or <20% of the
+        average area (only when there is more than one). Returns the keep
+        mask and the [x_min, y_min, x_max, y_max] bounds of the kept
+        contours with at least 3 points (x_max < 0 if there are none)."""
+        num_contours = offsets.shape[0] - 1
+        areas = np.zeros(num_contours, dtype=np.float64)
+        for i in range(num_contours):
+            start = offsets[i]
+            end = offsets[i + 1]
+            # Shoelace formula, same as cv2.contourArea
+            area = 0.0
+            for j in range(start, end):
+                k = j + 1 if j + 1 < end else start
+                area += (
+                    float(points[j, 0]) * float(points[k, 1])
+                    - float(points[k, 0]) * float(points[j, 1])
+                )
+            areas[i] = abs(area) * 0.5
+
+        keep = np.ones(num_contours, dtype=np.bool_)
+        if num_contours > 1:
+            min_area = areas.mean() * 0.2
+            max_area = image_size * 0.9
+            for i in range(num_contours):
+                keep[i] = min_area < areas[i] < max_area
+
+        bounds = np.array([100000000, 100000000, -1, -1], dtype=np.int64)
+        for i in range(num_contours):
+            if not keep[i] or offsets[i + 1] - offsets[i] < 3:
+                continue
+            for j in range(offsets[i], offsets[i + 1]):
+                bounds[0] = min(bounds[0], points[j, 0])
+                bounds[1] = min(bounds[1], points[j, 1])
+                bounds[2] = max(bounds[2], points[j, 0])
+                bounds[3] = max(bounds[3], points[j, 1])
+        return keep, bounds
 
 
 class SAM_HQ(Model):
@@ -61,6 +110,21 @@ def __init__(self, config_path, on_message) -> None:
             raise FileNotFoundError(
                 "Could not download or initialize encoder of SAM_HQ."
             )
+        # On CPU prefer an INT8 encoder: a prebuilt one from the config, or
+        # a dynamically quantized copy when "quantize" is set
+        if __preferred_device__ != "GPU":
+            if self.config.get("encoder_model_path_int8"):
+                int8_model_abs_path = self.get_model_abs_path(
+                    self.config, "encoder_model_path_int8"
+                )
+                if int8_model_abs_path and os.path.isfile(
+                    int8_model_abs_path
+                ):
+                    encoder_model_abs_path = int8_model_abs_path
+            elif self.config.get("quantize", False):
+                encoder_model_abs_path = self.get_quantized_model_abs_path(
+                    encoder_model_abs_path
+                )
         decoder_model_abs_path = self.get_model_abs_path(
             self.config, "decoder_model_path"
         )
@@ -83,12 +147,19 @@ def __init__(self, config_path, on_message) -> None:
         # Cache for image embedding
         self.cache_size = 10
         self.preloaded_size = self.cache_size - 3
+        # Keyed by image content, so renamed or duplicated files share an
+        # entry; preloaded_keys maps filenames to (file signature, key) so
+        # a file is only hashed again after it or its label file changes
         self.image_embedding_cache = LRUCache(self.cache_size)
+        self.preloaded_keys = LRUCache(self.cache_size)
+        # Shapes of recent (image, marks, output mode) requests, so repeated
+        # requests with unchanged prompts skip the decoder
+        self.shapes_cache = LRUCache(64)
 
         # Pre-inference worker
         self.pre_inference_thread = None
         self.pre_inference_worker = None
-        self.stop_inference = False
+        self.stop_event = threading.Event()
 
         # CLIP flows
         self.clip_net = None
@@ -113,6 +184,55 @@ def __init__(self, config_path, on_message) -> None:
                 )
             self.classes = self.config.get("classes", [])
 
+    @staticmethod
+    def get_file_signature(filename):
+        """Modification times of an image file and of its label file, whose
+        imageData load_image_from_filename prefers over the image file.
+        None if the image file cannot be read."""
+        try:
+            image_mtime_ns = os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+        label_file_path = os.path.splitext(filename)[0] + LabelFile.suffix
+        try:
+            label_mtime_ns = os.stat(label_file_path).st_mtime_ns
+        except OSError:
+            label_mtime_ns = None
+        return image_mtime_ns, label_mtime_ns
+
+    def get_cached_file_key(self, filename, image_shape=None):
+        """Embedding key memoized for filename, or None if the file was
+        never hashed or it or its label file changed since."""
+        entry = self.preloaded_keys.get(filename)
+        if entry is None:
+            return None
+        signature, key = entry
+        if signature != self.get_file_signature(filename):
+            return None
+        if image_shape is not None and key[1] != image_shape:
+            return None
+        return key
+
+    def get_image_key(self, cv_image, filename=None):
+        """Embedding key of cv_image, memoized per filename since hashing
+        a large image costs about as much as a decoder pass."""
+        if not filename:
+            return get_embedding_key(cv_image)
+        key = self.get_cached_file_key(filename, cv_image.shape)
+        if key is None:
+            signature = self.get_file_signature(filename)
+            key = get_embedding_key(cv_image)
+            if signature is not None:
+                self.preloaded_keys.put(filename, (signature, key))
+        return key
+
+    def get_marks_key(self):
+        """Hashable snapshot of the current marks and output mode."""
+        return self.output_mode, tuple(
+            (mark["type"], tuple(mark["data"]), mark.get("label"))
+            for mark in self.marks
+        )
+
     def set_auto_labeling_marks(self, marks):
         """Set auto labeling marks"""
         self.marks = marks
@@ -121,63 +241,71 @@ def post_process(self, masks, image=None):
         """
         Post process masks
         """
-        # Find contours
-        masks[masks > 0.0] = 255
-        masks[masks <= 0.0] = 0
-        masks = masks.astype(np.uint8)
+        # Binarize straight to a 0/255 uint8 mask in one pass, leaving the
+        # decoder output untouched, then find contours
+        masks = cv2.compare(
+            np.ascontiguousarray(masks, dtype=np.float32), 0.0, cv2.CMP_GT
+        )
         contours, _ = cv2.findContours(
-            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
 
         # Refine contours
         approx_contours = []
         for contour in contours:
+            # Too few points to simplify any further
+            if len(contour) <= 4:
+                approx_contours.append(contour)
+                continue
             # Approximate contour
             epsilon = 0.001 * cv2.arcLength(contour, True)
             approx = cv2.approxPolyDP(contour, epsilon, True)
             approx_contours.append(approx)
 
-        # Remove too big contours ( >90% of image size)
-        if len(approx_contours) > 1:
-            image_size = masks.shape[0] * masks.shape[1]
-            areas = [cv2.contourArea(contour) for contour in approx_contours]
-            filtered_approx_contours = [
+        # Remove too big contours ( >90% of image size) and small contours
+        # (area < 20% of average area), computing each area only once
+        image_size = masks.shape[0] * masks.shape[1]
+        bounds = None
+        if numba is not None and approx_contours:
+            points = np.concatenate(
+                [contour.reshape(-1, 2) for contour in approx_contours]
+            )
+            offsets = np.zeros(len(approx_contours) + 1, dtype=np.int64)
+            np.cumsum(
+                [len(contour) for contour in approx_contours], out=offsets[1:]
+            )
+            keep, bounds = filter_contours(points, offsets, image_size)
+            approx_contours = [
                 contour
-                for contour, area in zip(approx_contours, areas)
-                if area < image_size * 0.9
+                for contour, kept in zip(approx_contours, keep)
+                if kept
             ]
-
-        # Remove small contours (area < 20% of average area)
-        if len(approx_contours) > 1:
-            areas = [cv2.contourArea(contour) for contour in approx_contours]
-            avg_area = np.mean(areas)
-
-            filtered_approx_contours = [
+        elif len(approx_contours) > 1:
+            areas = np.array(
+                [cv2.contourArea(contour) for contour in approx_contours]
+            )
+            keep = (areas < image_size * 0.9) & (areas > areas.mean() * 0.2)
+            approx_contours = [
                 contour
-                for contour, area in zip(approx_contours, areas)
-                if area > avg_area * 0.2
+                for contour, kept in zip(approx_contours, keep)
+                if kept
             ]
-            approx_contours = filtered_approx_contours
 
         # Contours to shapes
         shapes = []
         if self.output_mode == "polygon":
             for approx in approx_contours:
-                # Scale points
-                points = approx.reshape(-1, 2)
-                points[:, 0] = points[:, 0]
-                points[:, 1] = points[:, 1]
-                points = points.tolist()
-                if len(points) < 3:
+                if len(approx) < 3:
                     continue
+                # Contour points are int32, tolist() yields Python ints
+                points = approx.reshape(-1, 2).astype(
+                    np.int32, copy=False
+                ).tolist()
                 points.append(points[0])
 
                 # Create shape
                 shape = Shape(flags={})
-                for point in points:
-                    point[0] = int(point[0])
-                    point[1] = int(point[1])
-                    shape.add_point(point[0], point[1])
+                shape.add_points(points)
                 shape.shape_type = "polygon"
                 shape.closed = True
                 shape.fill_color = "#000000"
@@ -191,28 +319,29 @@ def post_process(self, masks, image=None):
             y_min = 100000000
             x_max = 0
             y_max = 0
-            for approx in approx_contours:
-                # Scale points
-                points = approx.reshape(-1, 2)
-                points[:, 0] = points[:, 0]
-                points[:, 1] = points[:, 1]
-                points = points.tolist()
-                if len(points) < 3:
-                    continue
-
-                # Get min/max
-                for point in points:
-                    x_min = min(x_min, point[0])
-                    y_min = min(y_min, point[1])
-                    x_max = max(x_max, point[0])
-                    y_max = max(y_max, point[1])
+            # Get min/max over all contours with at least 3 points
+            if bounds is not None:
+                if bounds[2] >= 0:
+                    x_min, y_min, x_max, y_max = bounds.tolist()
+            else:
+                contour_points = [
+                    approx.reshape(-1, 2)
+                    for approx in approx_contours
+                    if len(approx) >= 3
+                ]
+                if contour_points:
+                    # boundingRect width/height count both edge pixels
+                    x_min, y_min, width, height = cv2.boundingRect(
+                        np.concatenate(contour_points, axis=0)
+                    )
+                    x_max = x_min + width - 1
+                    y_max = y_min + height - 1
 
             # Create shape
             shape = Shape(flags={})
-            shape.add_point(x_min, y_min)
-            shape.add_point(x_max, y_min)
-            shape.add_point(x_max, y_max)
-            shape.add_point(x_min, y_max)
+            shape.add_points(
+                [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]
+            )
             shape.shape_type = (
                 "rectangle" if self.output_mode == "rectangle" else "rotation"
             )
@@ -239,26 +368,38 @@ def predict_shapes(self, cv_image, filename=None) -> AutoLabelingResult:
 
         shapes = []
         try:
+            key = self.get_image_key(cv_image, filename)
+            # Reuse the shapes of an identical recent request
+            shapes_key = (key, self.get_marks_key())
+            cached_shapes = self.shapes_cache.get(shapes_key)
+            if cached_shapes is not None:
+                return AutoLabelingResult(
+                    [shape.copy() for shape in cached_shapes], replace=False
+                )
+
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
+            cached_data = self.image_embedding_cache.get(key)
             if cached_data is not None:
                 image_embedding = cached_data
             else:
-                if self.stop_inference:
+                if self.stop_event.is_set():
                     return AutoLabelingResult([], replace=False)
                 image_embedding = self.model.encode(cv_image)
                 self.image_embedding_cache.put(
-                    filename,
+                    key,
                     image_embedding,
                 )
-            if self.stop_inference:
+            if self.stop_event.is_set():
                 return AutoLabelingResult([], replace=False)
             masks = self.model.predict_masks(image_embedding, self.marks)
             if len(masks.shape) == 4:
-                masks = masks[0][0]
+                masks = masks[0, 0]
             else:
                 masks = masks[0]
             shapes = self.post_process(masks, cv_image)
+            self.shapes_cache.put(
+                shapes_key, [shape.copy() for shape in shapes]
+            )
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.warning(e)
@@ -269,28 +410,37 @@ def predict_shapes(self, cv_image, filename=None) -> AutoLabelingResult:
         return result
 
     def unload(self):
-        self.stop_inference = True
-        if self.pre_inference_thread:
-            self.pre_inference_thread.quit()
+        self.stop_event.set()
+        if self.pre_inference_thread is not None:
+            # The worker checks the event between files, so this only
+            # waits for the encoding in progress
+            self.pre_inference_thread.join(timeout=1.0)
 
     def preload_worker(self, files):
         """
         Preload next files, run inference and cache results
         """
-        files = files[: self.preloaded_size]
-        for filename in files:
-            if self.image_embedding_cache.find(filename):
-                continue
-            cv_image = self.load_image_from_filename(filename)
-            if cv_image is None:
-                continue
-            if self.stop_inference:
-                return
-            image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+        # Skip files whose embedding is already cached
+        pending = []
+        for filename in files[: self.preloaded_size]:
+            key = self.get_cached_file_key(filename)
+            if key is None or not self.image_embedding_cache.find(key):
+                pending.append(filename)
+
+        # Decode the next images while the current one is being encoded;
+        # encoding itself stays on this thread
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cv_images = executor.map(self.load_image_from_filename, pending)
+            for filename, cv_image in zip(pending, cv_images):
+                if self.stop_event.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                if cv_image is None:
+                    continue
+                key = self.get_image_key(cv_image, filename)
+                self.image_embedding_cache.setdefault_compute(
+                    key, lambda: self.model.encode(cv_image)
+                )
 
     def on_next_files_changed(self, next_files):
         """
@@ -299,9 +449,9 @@ def on_next_files_changed(self, next_files):
         """
         if (
             self.pre_inference_thread is None
-            or not self.pre_inference_thread.isRunning()
+            or not self.pre_inference_thread.is_alive()
         ):
             self.pre_inference_thread = threading.Thread(
-                target=self.preload_worker, args=(next_files,)
+                target=self.preload_worker, args=(next_files,), daemon=True
             )
             self.pre_inference_thread.start()
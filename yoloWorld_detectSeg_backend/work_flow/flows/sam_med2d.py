@@ -11,7 +11,7 @@
 
 from . import __preferred_device__, Shape, Model, AutoLabelingResult, ChineseClipONNX
 
-from .lru_cache import LRUCache
+from ..utils.lru_cache import LRUCache
 
 
 class SegmentAnythingONNX:
@@ -1,5 +1,7 @@
 import os
 
+import numpy as np
+
 from . import __preferred_device__, Shape, AutoLabelingResult, YOLO, RecognizeAnything, OnnxBaseModel
 
 
@@ -19,6 +21,10 @@ def __init__(self, model_config, on_message) -> None:
             )
         self.ram_net = OnnxBaseModel(tag_model_abs_path, __preferred_device__)
         self.ram_input_shape = self.ram_net.get_input_shape()[-2:]
+        # Exports with a dynamic batch dimension can tag all crops at once
+        self.ram_batched = not isinstance(
+            self.ram_net.get_input_shape()[0], int
+        )
         self.tag_mode = self.config.get("tag_mode", "")  # ['en', 'cn']
         self.tag_list, self.tag_list_chinese = self.load_tag_list()
         delete_tags = self.config.get("delete_tags", [])
@@ -48,17 +54,13 @@ def predict_shapes(self, image, image_path=None):
         outs = YOLO.inference(self, blob=blob)
         boxes, class_ids, _, _, _ = YOLO.postprocess(self, outs)
 
+        boxes = [list(map(int, box)) for box in boxes]
+        descriptions = self.get_box_descriptions(image, boxes)
+
         shapes = []
-        for box, cls_id in zip(boxes, class_ids):
+        for box, cls_id, description in zip(boxes, class_ids, descriptions):
             label = self.classes[int(cls_id)]
-            xmin, ymin, xmax, ymax = list(map(int, box))
-            img = image[ymin:ymax, xmin:xmax]
-            blob = RecognizeAnything.preprocess(
-                self, img, self.ram_input_shape
-            )
-            outs = self.ram_net.get_ort_inference(blob, extract=False)
-            tags = RecognizeAnything.postprocess(self, outs)
-            description = RecognizeAnything.get_results(self, tags)
+            xmin, ymin, xmax, ymax = box
             shape = Shape(  # 简直就是标签增强，相当于打text2tag标签
                 label=label,
                 description=description,
@@ -72,3 +74,32 @@ def predict_shapes(self, image, image_path=None):
 
         result = AutoLabelingResult(shapes, replace=True)
         return result
+
+    def get_box_descriptions(self, image, boxes):
+        """
+        Tag the crop of every box with RAM, in a single batched run when
+        the tagging model accepts a dynamic batch size
+        """
+        blobs = [
+            RecognizeAnything.preprocess(
+                self, image[ymin:ymax, xmin:xmax], self.ram_input_shape
+            )
+            for xmin, ymin, xmax, ymax in boxes
+        ]
+        if not blobs:
+            return []
+        if self.ram_batched:
+            outs = self.ram_net.get_ort_inference(
+                np.concatenate(blobs, axis=0), extract=False
+            )
+            en_tags, zh_tags = RecognizeAnything.postprocess(self, outs)
+            return [
+                RecognizeAnything.get_results(self, ([en], [zh]))
+                for en, zh in zip(en_tags, zh_tags)
+            ]
+        descriptions = []
+        for blob in blobs:
+            outs = self.ram_net.get_ort_inference(blob, extract=False)
+            tags = RecognizeAnything.postprocess(self, outs)
+            descriptions.append(RecognizeAnything.get_results(self, tags))
+        return descriptions
@@ -9,7 +9,6 @@
 import cv2
 import mmcv
 import numpy as np
-import PIL.ExifTags
 import PIL.Image
 import PIL.ImageOps
 from PIL import Image
@@ -49,8 +48,18 @@ def img_data_to_pil(img_data):
 
 
 def img_data_to_arr(img_data):
-    img_pil = img_data_to_pil(img_data)
-    img_arr = np.array(img_pil)
+    # OpenCV 解码更快，且无需中间的 PIL 对象；不支持的格式回退到 PIL
+    img_arr = cv2.imdecode(
+        np.frombuffer(img_data, dtype=np.uint8), cv2.IMREAD_UNCHANGED
+    )
+    if img_arr is None:
+        img_pil = img_data_to_pil(img_data)
+        return np.array(img_pil)
+    # 与 PIL 保持一致的通道顺序（RGB / RGBA）
+    if img_arr.ndim == 3 and img_arr.shape[2] == 3:
+        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BGR2RGB, dst=img_arr)
+    elif img_arr.ndim == 3 and img_arr.shape[2] == 4:
+        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BGRA2RGBA, dst=img_arr)
     return img_arr
 
 
@@ -153,18 +162,31 @@ def crop_polygon_object(image, polygon_points, background_color=(255, 255, 255))
 
 
 def img_arr_to_b64(img_arr):
-    img_pil = PIL.Image.fromarray(img_arr)
-    f = io.BytesIO()
-    img_pil.save(f, format="PNG")
-    img_bin = f.getvalue()
-    if hasattr(base64, "encodebytes"):
-        img_b64 = base64.encodebytes(img_bin)
+    # uint8 的灰度 / RGB / RGBA 图像直接用 OpenCV 编码，其余交给 PIL
+    if img_arr.dtype == np.uint8 and (
+        img_arr.ndim == 2 or (img_arr.ndim == 3 and img_arr.shape[2] in (3, 4))
+    ):
+        if img_arr.ndim == 3 and img_arr.shape[2] == 3:
+            img_arr = cv2.cvtColor(img_arr, cv2.COLOR_RGB2BGR)
+        elif img_arr.ndim == 3:
+            img_arr = cv2.cvtColor(img_arr, cv2.COLOR_RGBA2BGRA)
+        _, img_bin = cv2.imencode(".png", img_arr)
     else:
-        img_b64 = base64.encodestring(img_bin)
-    return img_b64
+        img_pil = PIL.Image.fromarray(img_arr)
+        f = io.BytesIO()
+        img_pil.save(f, format="PNG")
+        img_bin = f.getvalue()
+    # 单次编码且不插入换行，b64decode 的结果不变
+    return base64.b64encode(img_bin)
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
 
 def img_data_to_png_data(img_data):
+    # 已经是 PNG 数据时直接返回，避免一次完整的解码和重新编码
+    if img_data[:8] == PNG_SIGNATURE:
+        return img_data
     with io.BytesIO() as f:
         f.write(img_data)
         img = PIL.Image.open(f)
@@ -175,40 +197,64 @@ def img_data_to_png_data(img_data):
             return f.read()
 
 
+# EXIF Orientation 标签 ID
+EXIF_ORIENTATION_TAG = 0x0112
+
+
 def process_image_exif(filename):
     """Process image EXIF orientation and save if necessary."""
     with PIL.Image.open(filename) as img:
         exif_data = None
         if hasattr(img, "_getexif"):
             exif_data = img._getexif()
-        if exif_data is not None:
-            for tag, value in exif_data.items():
-                tag_name = PIL.ExifTags.TAGS.get(tag, tag)
-                if tag_name != "Orientation":
-                    continue
-                if value == 3:
-                    img = img.rotate(180, expand=True)
-                    rotation = "180 degrees"
-                elif value == 6:
-                    img = img.rotate(270, expand=True)
-                    rotation = "270 degrees"
-                elif value == 8:
-                    img = img.rotate(90, expand=True)
-                    rotation = "90 degrees"
-                else:
-                    return  # No rotation needed
-                backup_dir = osp.join(
-                    osp.dirname(osp.dirname(filename)),
-                    "x-anylabeling-exif-backup",
-                )
-                os.makedirs(backup_dir, exist_ok=True)
-                backup_filename = osp.join(backup_dir, osp.basename(filename))
-                shutil.copy2(filename, backup_filename)
-                img.save(filename)
-                logging.error(
-                    f"Rotated {filename} by {rotation}, saving backup to {backup_filename}"
-                )
-                break
+        if exif_data is None:
+            return
+        value = exif_data.get(EXIF_ORIENTATION_TAG)
+        if value == 3:
+            img = img.rotate(180, expand=True)
+            rotation = "180 degrees"
+        elif value == 6:
+            img = img.rotate(270, expand=True)
+            rotation = "270 degrees"
+        elif value == 8:
+            img = img.rotate(90, expand=True)
+            rotation = "90 degrees"
+        else:
+            return  # No rotation needed
+        backup_dir = osp.join(
+            osp.dirname(osp.dirname(filename)),
+            "x-anylabeling-exif-backup",
+        )
+        os.makedirs(backup_dir, exist_ok=True)
+        backup_filename = osp.join(backup_dir, osp.basename(filename))
+        shutil.copy2(filename, backup_filename)
+        img.save(filename)
+        logging.error(
+            f"Rotated {filename} by {rotation}, saving backup to {backup_filename}"
+        )
+
+
+# EXIF Orientation 值 -> 还原图像方向的变换
+EXIF_ORIENTATION_OPS = {
+    # left-to-right mirror
+    2: PIL.ImageOps.mirror,
+    # rotate 180
+    3: lambda image: image.transpose(PIL.Image.ROTATE_180),
+    # top-to-bottom mirror
+    4: PIL.ImageOps.flip,
+    # top-to-left mirror
+    5: lambda image: PIL.ImageOps.mirror(
+        image.transpose(PIL.Image.ROTATE_270)
+    ),
+    # rotate 270
+    6: lambda image: image.transpose(PIL.Image.ROTATE_270),
+    # top-to-right mirror
+    7: lambda image: PIL.ImageOps.mirror(
+        image.transpose(PIL.Image.ROTATE_90)
+    ),
+    # rotate 90
+    8: lambda image: image.transpose(PIL.Image.ROTATE_90),
+}
 
 
 def apply_exif_orientation(image):
@@ -220,36 +266,8 @@ def apply_exif_orientation(image):
     if exif is None:
         return image
 
-    exif = {
-        PIL.ExifTags.TAGS[k]: v
-        for k, v in exif.items()
-        if k in PIL.ExifTags.TAGS
-    }
-
-    orientation = exif.get("Orientation", None)
-
-    if orientation == 1:
-        # do nothing
+    # 1 和未知值无需处理
+    op = EXIF_ORIENTATION_OPS.get(exif.get(EXIF_ORIENTATION_TAG))
+    if op is None:
         return image
-    if orientation == 2:
-        # left-to-right mirror
-        return PIL.ImageOps.mirror(image)
-    if orientation == 3:
-        # rotate 180
-        return image.transpose(PIL.Image.ROTATE_180)
-    if orientation == 4:
-        # top-to-bottom mirror
-        return PIL.ImageOps.flip(image)
-    if orientation == 5:
-        # top-to-left mirror
-        return PIL.ImageOps.mirror(image.transpose(PIL.Image.ROTATE_270))
-    if orientation == 6:
-        # rotate 270
-        return image.transpose(PIL.Image.ROTATE_270)
-    if orientation == 7:
-        # top-to-right mirror
-        return PIL.ImageOps.mirror(image.transpose(PIL.Image.ROTATE_90))
-    if orientation == 8:
-        # rotate 90
-        return image.transpose(PIL.Image.ROTATE_90)
-    return image
+    return op(image)
@@ -0,0 +1,65 @@
+"""Thread-safe LRU cache implementation."""
+
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+
+
+def get_embedding_key(image):
+    """Key an image by its content for embedding caches."""
+    return (
+        hashlib.blake2b(np.ascontiguousarray(image), digest_size=16).digest(),
+        image.shape,
+        image.dtype.str,
+    )
+
+
+class LRUCache:
+    """Thread-safe LRU cache implementation."""
+
+    def __init__(self, maxsize=10):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def get(self, key):
+        """Get value from cache. Returns None if key is not present."""
+        with self.lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def put(self, key, value):
+        """Put value into cache. If cache is full, oldest item is evicted."""
+        with self.lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def find(self, key):
+        """Returns True if key is in cache, False otherwise."""
+        with self.lock:
+            return key in self._cache
+
+    def setdefault_compute(self, key, compute):
+        """Return the cached value for key, computing and caching it with
+        compute() if missing. compute runs outside the lock so readers are
+        not blocked; if another thread stored the key meanwhile, that value
+        is kept."""
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = compute()
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self._cache[key] = value
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return value
@@ -296,6 +296,23 @@ def add_point(self, x, y):
             else:
                 self.points.append(point)
 
+    def add_points(self, points):
+        """Add (x, y) points in bulk, same as calling add_point for each;
+        a point equal to the first one closes the shape"""
+        points = [(x, y) for x, y in points]
+        if not points:
+            return
+        if self.shape_type == "rectangle":
+            self.points.extend(points[: max(0, 4 - len(self.points))])
+            return
+        if not self.points:
+            self.points.append(points.pop(0))
+        first = self.points[0]
+        new_points = [point for point in points if point != first]
+        self.points.extend(new_points)
+        if len(new_points) != len(points):
+            self.close()
+
     def can_add_point(self):
         """Check if the shape can add more points"""
         return self.shape_type in ["polygon", "linestrip"]